@@ -18,4 +18,13 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
     ],
+    tests_require=[
+        'mock',
+    ],
+    entry_points={
+        'console_scripts': [
+            'symcpe-ironic-bench = '
+            'symcpe.ironic.nova.bench.provisioning:main',
+        ],
+    },
 )
@@ -0,0 +1,245 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per-build stage timing and external call counting.
+
+Stages are wrapped with timed(), clients with client(). Both are no-ops
+apart from a single flag check unless [symcpe]instrumentation_enabled is
+set. Timings go to per-stage latency histograms and, when the stage belongs
+to an instance being built, to a per-instance record which is emitted by
+flush() as a JSON log line and optionally appended to
+[symcpe]instrumentation_file. Only the build entry point opens such a
+record, stages running outside of a build (deletes, rebuilds) just feed the
+histograms.
+"""
+
+import bisect
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+opts = [
+    cfg.BoolOpt('instrumentation_enabled', default=False,
+                help='Record stage timings and external call counts per '
+                     'instance build'),
+    cfg.StrOpt('instrumentation_file', default='',
+               help='File to append JSON metrics lines to. Metrics are '
+                    'only logged when empty'),
+    cfg.IntOpt('instrumentation_interval', default=60,
+               help='Seconds between dumps of the stage histograms'),
+]
+CONF = cfg.CONF
+CONF.register_opts(opts, 'symcpe')
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_OPEN_BUILDS = 10000
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def to_dict(self):
+        buckets = dict(('le_%s' % bound, count)
+                       for bound, count in zip(BUCKETS, self.counts))
+        buckets['le_inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': self.total, 'buckets': buckets}
+
+
+class Recorder(object):
+    def __init__(self):
+        self._enabled = None
+        self._local = threading.local()
+        self._last_dump = time.time()
+        self.histograms = collections.defaultdict(Histogram)
+        self.calls = collections.Counter()
+        self.builds = collections.OrderedDict()
+
+    @property
+    def enabled(self):
+        # Resolved once, CONF lookups are too slow for every call
+        if self._enabled is None:
+            self._enabled = CONF.symcpe.instrumentation_enabled
+        return self._enabled
+
+    def reset(self):
+        self._enabled = None
+        self.histograms.clear()
+        self.calls.clear()
+        self.builds.clear()
+
+    def _build(self, instance_uuid):
+        build = self.builds.get(instance_uuid)
+        if build is None:
+            if len(self.builds) >= MAX_OPEN_BUILDS:
+                self.flush(next(iter(self.builds)))
+            build = self.builds[instance_uuid] = {
+                'stages': collections.defaultdict(list),
+                'calls': collections.defaultdict(collections.Counter)}
+        return build
+
+    @contextlib.contextmanager
+    def stage(self, name, instance_uuid=None, build=False):
+        previous = getattr(self._local, 'instance_uuid', None)
+        instance_uuid = instance_uuid or previous
+        self._local.instance_uuid = instance_uuid
+        if build and instance_uuid:
+            self._build(instance_uuid)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self._local.instance_uuid = previous
+            self.histograms[name].add(elapsed)
+            record = self.builds.get(instance_uuid)
+            if record is not None:
+                record['stages'][name].append(elapsed)
+            if start - self._last_dump > CONF.symcpe.instrumentation_interval:
+                self.dump()
+
+    def count(self, kind, name):
+        self.calls[(kind, name)] += 1
+        record = self.builds.get(getattr(self._local, 'instance_uuid', None))
+        if record is not None:
+            record['calls'][kind][name] += 1
+
+    def flush(self, instance_uuid):
+        build = self.builds.pop(instance_uuid, None)
+        if build is None:
+            return
+        self._emit({'type': 'build',
+                    'instance_uuid': instance_uuid,
+                    'stages': dict((name, {'count': len(values),
+                                           'sum': sum(values),
+                                           'max': max(values)})
+                                   for name, values in
+                                   build['stages'].items()),
+                    'calls': dict((kind, dict(counter))
+                                  for kind, counter in
+                                  build['calls'].items())})
+
+    def snapshot(self):
+        calls = collections.defaultdict(dict)
+        for (kind, name), count in self.calls.items():
+            calls[kind][name] = count
+        return {'type': 'histograms',
+                'stages': dict((name, histogram.to_dict())
+                               for name, histogram in
+                               self.histograms.items()),
+                'calls': dict(calls)}
+
+    def dump(self):
+        self._last_dump = time.time()
+        self._emit(self.snapshot())
+
+    def _emit(self, record):
+        line = json.dumps(record, sort_keys=True)
+        LOG.info('instrumentation %s', line)
+        if CONF.symcpe.instrumentation_file:
+            try:
+                with open(CONF.symcpe.instrumentation_file, 'a') as fd:
+                    fd.write(line + '\n')
+            except IOError as exc:
+                LOG.warning('Failed to write instrumentation metrics: %s',
+                            exc)
+
+
+RECORDER = Recorder()
+
+
+def timed(stage, instance_arg=None, build=False):
+    """Decorator recording the duration of ``stage``.
+
+    :param instance_arg: position of the instance in the arguments (self
+        included); the stage and the calls it makes are then accounted to
+        the build of that instance, if one is open. An ``instance`` keyword
+        argument is used otherwise.
+    :param build: open the build record of the instance, for the build
+        entry point only, which has to flush() it when done.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not RECORDER.enabled:
+                return func(*args, **kwargs)
+            if instance_arg is not None and len(args) > instance_arg:
+                instance = args[instance_arg]
+            else:
+                instance = kwargs.get('instance')
+            with RECORDER.stage(stage, getattr(instance, 'uuid', None),
+                                build):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(kind, name):
+    """Count an external call of ``kind`` (ironic, neutron, subprocess)."""
+    if RECORDER.enabled:
+        RECORDER.count(kind, name)
+
+
+def flush(instance_uuid):
+    """Emit and forget the record of a finished build."""
+    if RECORDER.enabled:
+        RECORDER.flush(instance_uuid)
+
+
+class CountingClient(object):
+    """Proxy counting every method call made through ``client``.
+
+    For ironic client wrappers the method name passed to call() is counted
+    instead of 'call' itself.
+    """
+
+    def __init__(self, client, kind):
+        self._client = client
+        self._kind = kind
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            RECORDER.count(self._kind,
+                           args[0] if name == 'call' and args else name)
+            return attr(*args, **kwargs)
+        return wrapper
+
+
+def client(obj, kind):
+    """Return ``obj`` wrapped with CountingClient if enabled."""
+    if not RECORDER.enabled or isinstance(obj, CountingClient):
+        return obj
+    return CountingClient(obj, kind)
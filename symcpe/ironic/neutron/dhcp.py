@@ -17,6 +17,8 @@ from oslo_config import cfg
 from neutron.agent.linux import dhcp
 from neutron.agent.linux import utils
 
+from symcpe.ironic import instrumentation
+
 
 OPTS = [
     cfg.StrOpt('dhcp_interface',
@@ -42,6 +44,12 @@ class Dnsmasq(dhcp.Dnsmasq):
             self.interface_name = cfg.CONF.symcpe.dhcp_interface
             self.spawn_process()
 
+    @instrumentation.timed('dnsmasq_reload')
+    def reload_allocations(self):
+        """Rebuild the dnsmasq files and HUP the process."""
+        instrumentation.count('subprocess', 'dnsmasq_hup')
+        return super(Dnsmasq, self).reload_allocations()
+
     def _build_cmdline_callback(self, pid_file):
         cmd = [
             '--no-hosts',
@@ -0,0 +1,372 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process stand-ins for Ironic, Neutron and the dnstool script.
+
+Every fake counts the calls it receives and sleeps for a configurable
+latency, so the benchmark can separate the cost of our extensions from the
+cost of the services behind them. neutron_patched() runs the upstream
+neutronv2 allocate_for_instance/deallocate_for_instance against the Neutron
+fake, with the instance info cache left out.
+"""
+
+import collections
+import contextlib
+import itertools
+import json
+import random
+
+import eventlet
+from ironicclient import exc as ironic_exc
+import netaddr
+from nova.network import model as network_model
+from nova.network.neutronv2 import api as neutron_api
+from nova import objects
+from oslo_utils import uuidutils
+
+
+NETWORKS = (('mgmt', 101), ('data', 102), ('prod', 103))
+
+_MISSING = object()
+
+
+@contextlib.contextmanager
+def patched(*patches):
+    """Set ``(target, name, value)`` attributes, restoring them on exit."""
+    saved = []
+    try:
+        for target, name, value in patches:
+            saved.append((target, name, vars(target).get(name, _MISSING)))
+            setattr(target, name, value)
+        yield
+    finally:
+        for target, name, value in reversed(saved):
+            if value is _MISSING:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+
+
+class Latency(object):
+    """Sleep for ``mean`` seconds, +/- ``jitter`` fraction of it."""
+
+    def __init__(self, mean=0.0, jitter=0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    def __call__(self):
+        if self.mean <= 0:
+            return
+        spread = self.mean * self.jitter
+        eventlet.sleep(max(0.0, random.uniform(self.mean - spread,
+                                               self.mean + spread)))
+
+
+class FakeObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeContext(object):
+    is_admin = True
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.project_name = 'bench'
+
+    def elevated(self):
+        return self
+
+
+class FakeInstance(object):
+    def __init__(self, node, project_id, role):
+        self.uuid = uuidutils.generate_uuid()
+        self.node = node
+        self.host = 'bench'
+        self.availability_zone = 'bench'
+        self.project_id = project_id
+        self.hostname = role
+        self.display_name = role
+        self.display_description = role
+        self.metadata = {'role': role}
+
+    def get_network_info(self):
+        return network_model.NetworkInfo([])
+
+    def save(self):
+        pass
+
+
+def requested_networks(network_ids):
+    objects.register_all()
+    return objects.NetworkRequestList(objects=[
+        objects.NetworkRequest(network_id=network_id)
+        for network_id in network_ids])
+
+
+@contextlib.contextmanager
+def neutron_patched(neutron):
+    """Point upstream neutronv2 at ``neutron``, skip the info cache."""
+    def get_instance_nw_info(self, context, instance, **kwargs):
+        return network_model.NetworkInfo([])
+
+    def update_instance_cache_with_nw_info(*args, **kwargs):
+        pass
+
+    with patched(
+            (neutron_api, 'get_client', lambda *args, **kwargs: neutron),
+            (neutron_api.API, 'get_instance_nw_info', get_instance_nw_info),
+            (neutron_api.base_api, 'update_instance_cache_with_nw_info',
+             update_instance_cache_with_nw_info)):
+        yield
+
+
+def _mac(counter):
+    value = next(counter)
+    return ':'.join('%02x' % b for b in
+                    (0x52, 0x54, (value >> 24) & 0xff, (value >> 16) & 0xff,
+                     (value >> 8) & 0xff, value & 0xff))
+
+
+def make_nodes(count, racks=20, zone='bench.example.com'):
+    """Build ``count`` nodes spread over ``racks`` racks.
+
+    Nodes follow the naming convention expected by generate_name:
+    b-spare-r<rack-position><rack-name>-<env>
+    """
+    macs = itertools.count(1)
+    nodes = []
+    for i in range(count):
+        rack = 'a%02d' % (i % racks)
+        position = i // racks + 1
+        interfaces = {'em1': _mac(macs), 'p1p1': _mac(macs),
+                      'p2p1': _mac(macs)}
+        network = {'mgmt': {'interfaces': ['em1'], 'vlan': 101,
+                            'type': 'symlink'},
+                   'bond0': {'interfaces': ['p1p1', 'p2p1'],
+                             'type': 'bond'},
+                   'bond0.102': {'interfaces': ['bond0'], 'vlan': 102,
+                                 'type': 'tagged'},
+                   'bond0.103': {'interfaces': ['bond0'], 'vlan': 103,
+                                 'type': 'tagged'}}
+        nodes.append(FakeObject(
+            uuid=uuidutils.generate_uuid(),
+            name='b-spare-r%02d%s-prod' % (position, rack),
+            extra={'dns_zone': zone, 'network': network,
+                   'interfaces': interfaces},
+            properties={'rack': rack},
+            instance_uuid=None,
+            instance_info={},
+            provision_state='available',
+            target_provision_state=None,
+            last_error=None))
+    return nodes
+
+
+class FakeIronicClient(object):
+    """Mimics nova.virt.ironic.client_wrapper.IronicClientWrapper.call"""
+
+    def __init__(self, nodes, latency=None):
+        self.latency = latency or Latency()
+        self.calls = collections.Counter()
+        self.nodes = dict((node.uuid, node) for node in nodes)
+        self.names = dict((node.name, node) for node in nodes)
+        self.ports = {}
+        for node in nodes:
+            port = FakeObject(uuid=uuidutils.generate_uuid(),
+                              node_uuid=node.uuid,
+                              address=node.extra['interfaces']['em1'],
+                              extra={})
+            self.ports[node.uuid] = port
+
+    def call(self, method, *args, **kwargs):
+        kwargs.pop('retry_on_conflict', None)
+        self.calls[method] += 1
+        self.latency()
+        return getattr(self, '_' + method.replace('.', '_'))(*args, **kwargs)
+
+    def _get_node(self, node_id):
+        node = self.nodes.get(node_id) or self.names.get(node_id)
+        if node is None:
+            raise ironic_exc.NotFound()
+        return node
+
+    def _node_get(self, node_id, fields=None):
+        return self._get_node(node_id)
+
+    def _node_get_by_instance_uuid(self, instance_uuid, fields=None):
+        for node in self.nodes.values():
+            if node.instance_uuid == instance_uuid:
+                return node
+        raise ironic_exc.NotFound()
+
+    def _node_list(self, **kwargs):
+        return list(self.nodes.values())
+
+    def _node_list_ports(self, node_id, detail=False):
+        return [self.ports[self._get_node(node_id).uuid]]
+
+    def _node_update(self, node_id, patch):
+        node = self._get_node(node_id)
+        self._apply_patch(node, patch)
+        return node
+
+    def _port_update(self, port_id, patch):
+        for port in self.ports.values():
+            if port.uuid == port_id:
+                self._apply_patch(port, patch)
+                return port
+        raise ironic_exc.NotFound()
+
+    @staticmethod
+    def _apply_patch(obj, patch):
+        for op in patch:
+            attr, key = op['path'].strip('/').split('/', 1)
+            target = getattr(obj, attr)
+            if op['op'] == 'remove':
+                if key not in target:
+                    raise ironic_exc.BadRequest()
+                del target[key]
+            else:
+                target[key] = op['value']
+
+
+class FakeNeutronClient(object):
+    """Mimics the subset of neutronclient used to allocate ports."""
+
+    def __init__(self, racks=20, latency=None):
+        self.latency = latency or Latency()
+        self.calls = collections.Counter()
+        self.networks = {}
+        self.subnets = collections.defaultdict(list)
+        self.ports = {}
+        self._free_ips = {}
+        for net_index, (name, _vlan) in enumerate(NETWORKS):
+            network_id = uuidutils.generate_uuid()
+            self.networks[network_id] = {'id': network_id, 'name': name}
+            for rack_index in range(racks):
+                cidr = netaddr.IPNetwork('10.%d.%d.0/24' %
+                                         (net_index, rack_index))
+                subnet = {'id': uuidutils.generate_uuid(),
+                          'network_id': network_id,
+                          'name': 'a%02d' % rack_index,
+                          'cidr': str(cidr),
+                          'gateway_ip': str(cidr[1])}
+                self.subnets[network_id].append(subnet)
+                # Gateway excluded, addresses of deleted ports come back
+                self._free_ips[subnet['id']] = collections.deque(
+                    str(ip) for ip in cidr.iter_hosts())
+                self._free_ips[subnet['id']].popleft()
+
+    def _call(self, method):
+        self.calls[method] += 1
+        self.latency()
+
+    def list_extensions(self):
+        self._call('list_extensions')
+        return {'extensions': []}
+
+    def list_networks(self, id=None, **kwargs):
+        self._call('list_networks')
+        return {'networks': [network for network in self.networks.values()
+                             if id is None or network['id'] in id]}
+
+    def list_security_groups(self, **kwargs):
+        self._call('list_security_groups')
+        return {'security_groups': []}
+
+    def show_network(self, network_id, **kwargs):
+        self._call('show_network')
+        return {'network': self.networks[network_id]}
+
+    def list_subnets(self, network_id=None, name=None, **kwargs):
+        self._call('list_subnets')
+        return {'subnets': [subnet for subnet in self.subnets[network_id]
+                            if name is None or subnet['name'] == name]}
+
+    def show_subnet(self, subnet_id, **kwargs):
+        self._call('show_subnet')
+        for subnets in self.subnets.values():
+            for subnet in subnets:
+                if subnet['id'] == subnet_id:
+                    return {'subnet': subnet}
+
+    def create_port(self, body=None):
+        self._call('create_port')
+        port = dict(body['port'])
+        port['id'] = uuidutils.generate_uuid()
+        port['fixed_ips'] = [
+            dict(fixed_ip,
+                 ip_address=fixed_ip.get('ip_address') or
+                 self._free_ips[fixed_ip['subnet_id']].popleft())
+            for fixed_ip in port.get('fixed_ips', [])]
+        self.ports[port['id']] = port
+        return {'port': port}
+
+    def list_ports(self, **filters):
+        self._call('list_ports')
+        return {'ports': [port for port in self.ports.values()
+                          if all(port.get(key) == value
+                                 for key, value in filters.items())]}
+
+    def show_port(self, port_id, **kwargs):
+        self._call('show_port')
+        return {'port': self.ports[port_id]}
+
+    def delete_port(self, port_id):
+        self._call('delete_port')
+        port = self.ports.pop(port_id, None)
+        for fixed_ip in port['fixed_ips'] if port else []:
+            self._free_ips[fixed_ip['subnet_id']].append(
+                fixed_ip['ip_address'])
+
+
+class FakeInstanceMetadata(object):
+    def __init__(self, instance, content=None, extra_md=None,
+                 network_info=None):
+        self.instance = instance
+        self.extra_md = extra_md
+
+
+class FakeConfigDriveBuilder(object):
+    """Writes the extra metadata as JSON instead of rendering an ISO."""
+
+    def __init__(self, instance_md, latency=None):
+        self.instance_md = instance_md
+        self.latency = latency or Latency()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def make_drive(self, path):
+        self.latency()
+        with open(path, 'wb') as fd:
+            fd.write(json.dumps(self.instance_md.extra_md).encode('utf-8'))
+
+
+class FakeDNSScript(object):
+    """Replaces nova.utils.execute for the dnstool script."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.calls = collections.Counter()
+
+    def __call__(self, *cmd, **kwargs):
+        action = cmd[cmd.index('--action') + 1]
+        self.calls[action] += 1
+        self.latency()
+        return '', ''
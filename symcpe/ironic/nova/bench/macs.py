@@ -0,0 +1,116 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Port allocation benchmark with and without the former set() shim.
+
+The network API used to replace the module level ``set`` of
+nova.network.neutronv2.api with a shim doing an import and an isinstance
+check, paid by every set() upstream builds. This times the upstream
+allocate_for_instance and deallocate_for_instance, through our network API
+and its MAC provider hook, against the in-process fakes: once as is and
+once with that shim installed again.
+
+Usage:
+    python -m symcpe.ironic.nova.bench.macs --instances 200 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+
+from nova.network.neutronv2 import api as neutron_api
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from symcpe.ironic.nova.bench import fakes
+from symcpe.ironic.nova import naming
+from symcpe.ironic.nova.network import api as network_api
+from symcpe.ironic.nova.network import dnstool
+from symcpe.ironic.nova.virt.ironic import driver
+
+
+CONF = cfg.CONF
+
+
+def legacy_set_patch(iterable=None):
+    """The shim which used to be installed as neutronv2 api.set"""
+    from symcpe.ironic.nova.virt.ironic.driver import MacFactory
+    if isinstance(iterable, MacFactory):
+        return iterable
+    else:
+        return set(iterable)
+
+
+def _run(net_api, context, instances, nodes, networks):
+    """Return the seconds spent allocating and deallocating ports."""
+    allocate = deallocate = 0.0
+    for instance in instances:
+        macs = driver.MacFactory(instance, nodes[instance.node])
+        start = time.time()
+        net_api.allocate_for_instance(context, instance, macs=macs,
+                                      requested_networks=networks)
+        allocated = time.time()
+        net_api.deallocate_for_instance(context, instance,
+                                        requested_networks=networks)
+        deallocate += time.time() - allocated
+        allocate += allocated - start
+    return allocate, deallocate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--instances', type=int, default=200,
+                        help='Instances allocated and deallocated per run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per variant, the best one is reported')
+    parser.add_argument('--racks', type=int, default=20)
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='nova.conf to read options from')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    CONF([], project='nova', default_config_files=args.config_file)
+
+    nodes = fakes.make_nodes(args.instances, racks=args.racks)
+    naming.INDEX.update(nodes)
+    neutron = fakes.FakeNeutronClient(args.racks)
+    context = fakes.FakeContext(uuidutils.generate_uuid())
+    networks = fakes.requested_networks(neutron.networks)
+    instances = []
+    for node in nodes:
+        # What generate_name stores on the instance during a build
+        entry = naming.INDEX.get(node.uuid)
+        instance = fakes.FakeInstance(node.uuid, context.project_id, 'bench')
+        instance.hostname = entry.hostname('bench')
+        instance.metadata.update(rack=entry.rack, dns_domain=entry.zone)
+        instances.append(instance)
+    nodes = dict((node.uuid, node) for node in nodes)
+    net_api = network_api.API()
+
+    print('%-12s %12s %12s' % ('', 'allocate', 'deallocate'))
+    with fakes.neutron_patched(neutron), \
+            fakes.patched((dnstool.utils, 'execute', fakes.FakeDNSScript())):
+        for label, patches in (
+                ('current', ()),
+                ('legacy shim', ((neutron_api, 'set', legacy_set_patch),))):
+            with fakes.patched(*patches):
+                runs = [_run(net_api, context, instances, nodes, networks)
+                        for _ in range(args.repeat)]
+            print('%-12s %9.1f us %9.1f us per instance' % (
+                label,
+                min(run[0] for run in runs) / args.instances * 1e6,
+                min(run[1] for run in runs) / args.instances * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""End-to-end provisioning benchmark.
+
+Drives the build path through our extensions:
+    ComputeManager._build_and_run_instance -> generate_name ->
+    macs_for_instance -> API.allocate_for_instance -> API._create_port ->
+    DNS -> _add_driver_fields -> _plug_vifs -> _generate_configdrive
+against the in-process fakes from symcpe.ironic.nova.bench.fakes. Upstream
+pieces which would talk to real services (the rest of the build, the
+network info cache, the driver fields patch and the ISO rendering) are
+replaced by stand-ins with the same configurable latency.
+
+Usage:
+    symcpe-ironic-bench --concurrency 1,10,100,500 \\
+        --ironic-latency 0.05 --output bench-results \\
+        --baseline bench-results/provisioning-0.1.0-1460000000.json
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+import eventlet
+import pkg_resources
+from nova.compute import manager
+from nova.virt.ironic import driver as ironic_driver
+from oslo_config import cfg
+from oslo_utils import importutils
+from oslo_utils import uuidutils
+
+from symcpe.ironic import instrumentation
+from symcpe.ironic.nova.bench import fakes
+from symcpe.ironic.nova.compute import hook
+from symcpe.ironic.nova import naming
+from symcpe.ironic.nova.network import api as network_api
+from symcpe.ironic.nova.network import dnstool
+from symcpe.ironic.nova.virt.ironic import driver
+
+
+CONF = cfg.CONF
+
+DEFAULT_CONCURRENCY = '1,10,50,100,250,500'
+# Fewer builds time too little work for the regression check to be stable
+MIN_BUILDS = 100
+
+
+def _upstream_build(self, context, instance, image, decoded_files,
+                    admin_password, requested_networks, security_groups,
+                    block_device_mapping, node, limits, filter_properties):
+    """Stands in for nova's _build_and_run_instance.
+
+    Allocates the ports through the network API and then runs the parts of
+    IronicDriver.spawn which we override.
+    """
+    neutron = self._bench_neutron
+    macs = self.driver.macs_for_instance(instance)
+    self.network_api.allocate_for_instance(
+        context, instance, macs=macs, requested_networks=requested_networks,
+        security_groups=security_groups)
+    # Upstream builds this from the network info cache, which is not
+    # modelled and therefore read from the fake without counting.
+    ports = dict((port['network_id'], port) for port in neutron.ports.values()
+                 if port['device_id'] == instance.uuid)
+    network_info = []
+    for request in requested_networks:
+        network_id = request.network_id
+        port = ports[network_id]
+        fixed_ip = port['fixed_ips'][0]
+        subnet = [_s for _s in neutron.subnets[network_id]
+                  if _s['id'] == fixed_ip['subnet_id']][0]
+        network_info.append(
+            {'id': port['id'],
+             'address': port.get('mac_address'),
+             'network': {'id': network_id,
+                         'label': neutron.networks[network_id]['name'],
+                         'subnets': [{
+                             'cidr': subnet['cidr'],
+                             'gateway': {'address': subnet['gateway_ip']},
+                             'ips': [{'address': fixed_ip['ip_address']}]
+                         }]}})
+
+    ironic_node = self.driver.ironicclient.call('node.get', node)
+    self.driver._add_driver_fields(ironic_node, instance, image, None)
+    self.driver._plug_vifs(ironic_node, instance, network_info)
+    self.driver._generate_configdrive(instance, ironic_node, network_info,
+                                      extra_md={}, files=decoded_files)
+
+
+@contextlib.contextmanager
+def _upstream_patched(dns_script, configdrive_latency):
+    def add_driver_fields(self, node, instance, *args, **kwargs):
+        node.instance_uuid = instance.uuid
+        patch = [{'op': 'add', 'path': '/instance_info/image_source',
+                  'value': 'bench'}]
+        self.ironicclient.call('node.update', node.uuid, patch)
+
+    with fakes.patched(
+            (manager.ComputeManager, '_build_and_run_instance',
+             _upstream_build),
+            (ironic_driver.IronicDriver, '_add_driver_fields',
+             add_driver_fields),
+            (driver.instance_metadata, 'InstanceMetadata',
+             fakes.FakeInstanceMetadata),
+            (driver.configdrive, 'ConfigDriveBuilder',
+             functools.partial(fakes.FakeConfigDriveBuilder,
+                               latency=configdrive_latency)),
+            (dnstool.utils, 'execute', dns_script)):
+        yield
+
+
+def _make_manager(ironic, neutron):
+    """Assemble the compute manager without touching any real service."""
+    # IronicDriver.__init__ is skipped, do its lazy import here
+    if ironic_driver.ironic is None:
+        ironic_driver.ironic = importutils.import_module('ironicclient')
+        ironic_driver.ironic.exc = importutils.import_module(
+            'ironicclient.exc')
+
+    sym_driver = driver.SymIronicDriver.__new__(driver.SymIronicDriver)
+    sym_driver.ironicclient = instrumentation.client(
+        driver.IronicClientWrapper(ironic), 'ironic')
+    sym_driver._names = naming.INDEX
+
+    net_api = network_api.API()
+    net_api.ironicclient = instrumentation.client(ironic, 'ironic')
+
+    compute = hook.ComputeManager.__new__(hook.ComputeManager)
+    compute.driver = sym_driver
+    compute.network_api = net_api
+    compute._bench_neutron = neutron
+    return compute
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+    return {'min': values[0], 'p50': pick(0.5), 'p95': pick(0.95),
+            'p99': pick(0.99), 'max': values[-1]}
+
+
+def _per_build(counter, builds):
+    return dict((name, float(count) / builds)
+                for name, count in counter.items())
+
+
+def run_level(concurrency, builds, args):
+    """Build ``builds`` instances with ``concurrency`` green threads."""
+    def latency(mean):
+        return fakes.Latency(mean, args.jitter)
+
+    nodes = fakes.make_nodes(builds, racks=args.racks)
+    ironic = fakes.FakeIronicClient(nodes, latency(args.ironic_latency))
+    neutron = fakes.FakeNeutronClient(args.racks,
+                                      latency(args.neutron_latency))
+    dns_script = fakes.FakeDNSScript(latency(args.dns_latency))
+    instrumentation.RECORDER.reset()
+    compute = _make_manager(ironic, neutron)
+    # What the periodic node cache refresh provides, not counted per build
+    naming.INDEX.update(ironic.nodes.values())
+    context = fakes.FakeContext(uuidutils.generate_uuid())
+    networks = fakes.requested_networks(neutron.networks)
+    instances = [fakes.FakeInstance(node.uuid, context.project_id, 'bench')
+                 for node in nodes]
+    durations = []
+
+    def build(instance):
+        start = time.time()
+        compute._build_and_run_instance(
+            context, instance, {}, [], None, networks, [], {},
+            instance.node, {}, {})
+        durations.append(time.time() - start)
+
+    with _upstream_patched(dns_script, latency(args.configdrive_latency)), \
+            fakes.neutron_patched(neutron):
+        pool = eventlet.GreenPool(concurrency)
+        start = time.time()
+        for _ in pool.imap(build, instances):
+            pass
+        wall_time = time.time() - start
+
+    calls = {'ironic': _per_build(ironic.calls, builds),
+             'neutron': _per_build(neutron.calls, builds),
+             'dns': _per_build(dns_script.calls, builds)}
+    result = {'concurrency': concurrency,
+              'builds': builds,
+              'wall_time': wall_time,
+              'throughput': builds / wall_time,
+              'latency': _percentiles(durations),
+              'calls_per_build': calls,
+              'total_calls_per_build': dict(
+                  (service, sum(counts.values()))
+                  for service, counts in calls.items())}
+    if instrumentation.RECORDER.enabled:
+        result['stages'] = instrumentation.RECORDER.snapshot()['stages']
+    return result
+
+
+def compare(baseline, results, threshold):
+    """Return a list of human readable regressions against ``baseline``."""
+    previous = dict((level['concurrency'], level)
+                    for level in baseline['results'])
+    regressions = []
+    for level in results:
+        old = previous.get(level['concurrency'])
+        if not old:
+            continue
+        if level['throughput'] < old['throughput'] * (1 - threshold):
+            regressions.append(
+                'concurrency {0}: throughput {1:.2f}/s, was {2:.2f}/s'.format(
+                    level['concurrency'], level['throughput'],
+                    old['throughput']))
+        for service, calls in level['total_calls_per_build'].items():
+            old_calls = old['total_calls_per_build'].get(service, 0)
+            if calls > old_calls:
+                regressions.append(
+                    'concurrency {0}: {1} calls per build {2:.2f}, '
+                    'was {3:.2f}'.format(level['concurrency'], service,
+                                         calls, old_calls))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY,
+                        help='Comma separated concurrency levels')
+    parser.add_argument('--builds', type=int, default=0,
+                        help='Builds per level, defaults to the '
+                             'concurrency but at least %d' % MIN_BUILDS)
+    parser.add_argument('--racks', type=int, default=20)
+    parser.add_argument('--ironic-latency', type=float, default=0.0)
+    parser.add_argument('--neutron-latency', type=float, default=0.0)
+    parser.add_argument('--dns-latency', type=float, default=0.0)
+    parser.add_argument('--configdrive-latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Latency spread as a fraction of the mean')
+    parser.add_argument('--output', default='bench-results',
+                        help='Directory to store the results in')
+    parser.add_argument('--baseline',
+                        help='Previous result file to check regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Tolerated throughput drop as a fraction')
+    parser.add_argument('--instrument', action='store_true',
+                        help='Record per stage histograms as well')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='nova.conf to read symcpe options from')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    eventlet.monkey_patch(os=False)
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    CONF([], project='nova', default_config_files=args.config_file)
+    if args.instrument:
+        CONF.set_override('instrumentation_enabled', True, 'symcpe')
+
+    results = []
+    for concurrency in [int(_c) for _c in args.concurrency.split(',')]:
+        builds = args.builds or max(concurrency, MIN_BUILDS)
+        level = run_level(concurrency, builds, args)
+        results.append(level)
+        print('concurrency {concurrency:4d} builds {builds:4d} '
+              'wall {wall_time:8.3f}s throughput {throughput:8.2f}/s '
+              'p95 {p95:.4f}s calls/build {calls}'.format(
+                  p95=level['latency']['p95'],
+                  calls=level['total_calls_per_build'], **level))
+
+    version = pkg_resources.get_distribution('symcpe.ironic').version
+    timestamp = int(time.time())
+    report = {'version': version,
+              'timestamp': timestamp,
+              'settings': vars(args),
+              'results': results}
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    path = os.path.join(args.output,
+                        'provisioning-{0}-{1}.json'.format(version, timestamp))
+    with open(path, 'w') as fd:
+        json.dump(report, fd, indent=2, sort_keys=True)
+    print('Results stored in %s' % path)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            regressions = compare(json.load(fd), results, args.threshold)
+        for line in regressions:
+            print('REGRESSION %s' % line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,8 @@
 from oslo_log import log as logging
 from nova.compute import manager
 
+from symcpe.ironic import instrumentation
+
 
 LOG = logging.getLogger(__name__)
 DEFAULT_RESOURCE_NAME = 'nova'
@@ -34,6 +36,20 @@ class ComputeManager(manager.ComputeManager):
             self, context, instance, image, decoded_files, admin_password,
             requested_networks, security_groups, block_device_mapping, node,
             limits, filter_properties):
+        try:
+            return self._timed_build_and_run_instance(
+                context, instance, image, decoded_files, admin_password,
+                requested_networks, security_groups, block_device_mapping,
+                node, limits, filter_properties)
+        finally:
+            instrumentation.flush(instance.uuid)
+
+    @instrumentation.timed('build_and_run_instance', instance_arg=2,
+                           build=True)
+    def _timed_build_and_run_instance(
+            self, context, instance, image, decoded_files, admin_password,
+            requested_networks, security_groups, block_device_mapping, node,
+            limits, filter_properties):
         LOG.debug("HookBuild PRE begin")
         name, meta = self.driver.generate_name(context, instance, node)
         instance.metadata.update(meta)
@@ -0,0 +1,75 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Node naming index used by the compute driver.
+
+Node names are parsed once per change of the node listing the driver
+already refreshes periodically, so generate_name becomes a lookup without
+extra Ironic calls.
+"""
+
+
+class NodeName(object):
+    """Parsed node name. Expected format:
+    b-spare-r<rack-position><rack-name>-<env>
+    """
+
+    def __init__(self, node):
+        self.uuid = node.uuid
+        self.zone = node.extra['dns_zone']
+        self.rack = node.properties['rack']
+        self.key = (node.name, self.zone, self.rack)
+        parts = node.name.split('-')
+        self.prefix = parts[0] + '-'
+        self.suffix = '-' + '-'.join(parts[-2:])
+
+    def hostname(self, role):
+        return self.prefix + role + self.suffix
+
+
+class NodeNameIndex(object):
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, node_uuid):
+        return self._entries.get(node_uuid)
+
+    def add(self, node):
+        """Index a single node, raises if it lacks dns_zone or rack."""
+        entry = self._entries.get(node.uuid)
+        if (entry is None or
+                entry.key != (node.name, node.extra.get('dns_zone'),
+                              node.properties.get('rack'))):
+            entry = self._entries[node.uuid] = NodeName(node)
+        return entry
+
+    def update(self, nodes):
+        """Re-index from a complete node listing.
+
+        Only nodes whose name, zone or rack changed are parsed again, nodes
+        missing from the listing are dropped.
+        """
+        seen = set()
+        for node in nodes:
+            seen.add(node.uuid)
+            try:
+                self.add(node)
+            except (KeyError, TypeError, AttributeError):
+                # Not a node we are able to name, keep it out
+                self._entries.pop(node.uuid, None)
+        for node_uuid in set(self._entries) - seen:
+            del self._entries[node_uuid]
+
+
+INDEX = NodeNameIndex()
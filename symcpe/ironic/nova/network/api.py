@@ -15,32 +15,55 @@
 from nova.network.neutronv2 import api
 from nova.virt.ironic import client_wrapper
 
+from symcpe.ironic import instrumentation
 from symcpe.ironic.nova.network import dnstool
 
 LOG = api.LOG
 excutils = api.excutils
 
 
-# here is the ugly magic in order to avoid copy-pasting allocate_for_instance
-def set_patch(iterable=None):
-    from symcpe.ironic.nova.virt.ironic.driver import MacFactory
-    if isinstance(iterable, MacFactory):
-        return iterable
-    else:
-        return set(iterable)
-
-api.set = set_patch
-
-
 class API(api.API):
     pxe_net = 'mgmt'
     prod_net = 'prod'
 
     def __init__(self, *args, **kwargs):
         super(API, self).__init__(*args, **kwargs)
-        self.ironicclient = client_wrapper.IronicClientWrapper()
+        self.ironicclient = instrumentation.client(
+            client_wrapper.IronicClientWrapper(), 'ironic')
         self.dns_api = dnstool.DNSTool()
+        self._mac_providers = {}
+
+    def allocate_for_instance(self, context, instance, **kwargs):
+        """ Keep a MAC provider (driver's MacFactory) aside.
+
+        Upstream turns ``macs`` into a set, a provider callable is stored
+        per instance instead and consulted by _macs_for_network.
+        """
+        macs = kwargs.get('macs')
+        if not callable(macs):
+            return super(API, self).allocate_for_instance(
+                context, instance, **kwargs)
+        kwargs['macs'] = None
+        self._mac_providers[instance.uuid] = macs
+        try:
+            return super(API, self).allocate_for_instance(
+                context, instance, **kwargs)
+        finally:
+            self._mac_providers.pop(instance.uuid, None)
+
+    def _macs_for_network(self, instance, network, available_macs=None):
+        """ MACs a port of the instance on ``network`` may use.
+
+        :param available_macs: set of MACs passed down by upstream, used
+            when allocate_for_instance got no MAC provider
+        :rtype: set or None for any
+        """
+        provider = self._mac_providers.get(instance.uuid)
+        if provider is not None:
+            return set([provider(network)])
+        return available_macs
 
+    @instrumentation.timed('create_port', instance_arg=2)
     def _create_port(self, port_client, instance, network_id, port_req_body,
                      fixed_ip=None, security_group_ids=None,
                      available_macs=None, dhcp_opts=None):
@@ -49,12 +72,13 @@ class API(api.API):
          2. Add DNS integration
         """
         api.LOG.info('Create port for host: %s', instance.host)
+        port_client = instrumentation.client(port_client, 'neutron')
         # Pick the rack's subnet
         subnet_name = instance.metadata['rack']
         network = port_client.show_network(network_id)['network']
         subnets = port_client.list_subnets(network_id=network_id,
                                            name=subnet_name)['subnets']
-        macs = set([available_macs(network)])
+        macs = self._macs_for_network(instance, network, available_macs)
         if subnets:
             fixed_ip_dict = {'subnet_id': subnets[0]['id']}
         if fixed_ip:
@@ -73,9 +97,11 @@ class API(api.API):
         self.dns_api.register(fqdn, port['port']['fixed_ips'][0]['ip_address'])
         return port_id
 
+    @instrumentation.timed('delete_ports', instance_arg=2)
     def _delete_ports(self, neutron, instance, ports, raise_if_fail=False):
         """ Overload port deletion in order to implement DNS integration
         """
+        neutron = instrumentation.client(neutron, 'neutron')
         for port_id in ports:
             try:
                 port = neutron.show_port(port_id)['port']
@@ -16,6 +16,8 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from nova import utils
 
+from symcpe.ironic import instrumentation
+
 
 LOG = logging.getLogger(__name__)
 
@@ -42,6 +44,7 @@ class DNSTool(object):
     def delete(self, fqdn, ip):
         self._delete(fqdn, ip)
 
+    @instrumentation.timed('dns_register')
     def register(self, fqdn, ip):
         command = [self.script,
                    '--api_url', CONF.sym_dns.api_url,
@@ -52,6 +55,7 @@ class DNSTool(object):
                    '--value', ip,
                    '--ttl', '3600']
         LOG.debug('Running: %s', ' '.join(command))
+        instrumentation.count('subprocess', 'dnstool')
         try:
             utils.execute(*command)
             LOG.info('DNS record {0} added for IP {1}'.format(fqdn, ip))
@@ -60,6 +64,7 @@ class DNSTool(object):
                    'message {2}').format(fqdn, ip, exc.stderr)
             LOG.warning(msg)
 
+    @instrumentation.timed('dns_delete')
     def _delete(self, fqdn, ip):
         command = [self.script,
                    '--api_url', CONF.sym_dns.api_url,
@@ -69,6 +74,7 @@ class DNSTool(object):
                    '--type', 'A,PTR',
                    '--value', ip]
         LOG.debug('Running: %s', ' '.join(command))
+        instrumentation.count('subprocess', 'dnstool')
         try:
             utils.execute(*command)
             LOG.info('DNS record {0} deleted for IP {1}'.format(fqdn, ip))
@@ -21,6 +21,8 @@ from oslo_log import log as logging
 from nova.compute import api as compute
 from nova.scheduler import weights as weights_base
 
+from symcpe.ironic import instrumentation
+
 
 CONF = cfg.CONF
 
@@ -32,6 +34,7 @@ class RackDistributionWeigher(weights_base.BaseHostWeigher):
         super(RackDistributionWeigher, self).__init__(*args, **kwargs)
         self.compute_api = compute.API()
 
+    @instrumentation.timed('rack_weigh_objects')
     def weigh_objects(self, weighed_obj_list, weight_properties):
         """ Weigh multiple objects."""
         flavor = weight_properties['instance_type']
@@ -12,13 +12,30 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import base64
+import gzip
 import netaddr
 import re
+import shutil
+import sys
+import tempfile
+import threading
 
+from eventlet import event
 from oslo_config import cfg
+from oslo_utils import excutils
+from requests import adapters
+from nova.api.metadata import base as instance_metadata
 from nova import exception
+from nova.i18n import _LE
+from nova.virt import configdrive
+from nova.virt.ironic import client_wrapper
 from nova.virt.ironic import driver
 
+from symcpe.ironic import instrumentation
+from symcpe.ironic.nova import naming
+from symcpe.ironic.nova.virt.ironic import watcher
+
 LOG = driver.LOG
 
 opts = [
@@ -29,6 +46,17 @@ opts = [
                 default={'101': 'mgmt', '102': 'data', '103': 'prod'},
                 help='Dictionary to match vlan tag to network name to get'
                      ' IP from'),
+    cfg.IntOpt('ironic_pool_size', default=0,
+               help='Keep-alive HTTP connections shared by all Ironic '
+                    'requests, 0 to use the upstream client. The pooled '
+                    'session authenticates with [ironic]admin_auth_token '
+                    'or the [ironic] keystone v2 credentials only'),
+    cfg.IntOpt('ironic_min_concurrency', default=4,
+               help='Lower bound of concurrent Ironic requests of the '
+                    'pooled session'),
+    cfg.IntOpt('ironic_max_concurrency', default=50,
+               help='Upper bound of concurrent Ironic requests of the '
+                    'pooled session'),
 ]
 
 symcpe_group = cfg.OptGroup(name='symcpe', title='Symantec CPE Options')
@@ -83,10 +111,192 @@ class MacFactory(object):
         return item in self.interfaces.values()
 
 
+class AdaptiveLimiter(object):
+    """Bounds concurrent requests, AIMD style.
+
+    The limit is halved when Ironic pushes back (409/503) and grows by one
+    per limit-worth of successful requests.
+    """
+
+    def __init__(self, minimum, maximum):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(self.maximum)
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def success(self):
+        with self._cond:
+            previous = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if int(self.limit) > previous:
+                self._cond.notify()
+
+    def backoff(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit / 2)
+            LOG.debug('Ironic pushed back, concurrency limit is now %d',
+                      self.limit)
+
+
+class LimitedHTTPAdapter(adapters.HTTPAdapter):
+    """Connection pool taking a limiter slot per HTTP request.
+
+    Every attempt, ironicclient retries included, holds its own slot only
+    while on the wire and reports its answer, so retry sleeps do not hold
+    slots and every 409/503 makes the limiter back off.
+    """
+
+    def __init__(self, limiter, pool_size):
+        self.limiter = limiter
+        super(LimitedHTTPAdapter, self).__init__(pool_connections=1,
+                                                 pool_maxsize=pool_size)
+
+    def send(self, request, **kwargs):
+        with self.limiter:
+            response = super(LimitedHTTPAdapter, self).send(request, **kwargs)
+        if response.status_code in (409, 503):
+            self.limiter.backoff()
+        elif response.status_code < 500:
+            self.limiter.success()
+        return response
+
+
+def _pooled_session(pool_size, limiter):
+    """Keystone session with a keep-alive connection pool of pool_size."""
+    from keystoneclient.auth.identity import v2 as v2_auth
+    from keystoneclient.auth import token_endpoint
+    from keystoneclient import session as ks_session
+
+    if CONF.ironic.admin_auth_token:
+        auth = token_endpoint.Token(CONF.ironic.api_endpoint,
+                                    CONF.ironic.admin_auth_token)
+    else:
+        auth = v2_auth.Password(auth_url=CONF.ironic.admin_url,
+                                username=CONF.ironic.admin_username,
+                                password=CONF.ironic.admin_password,
+                                tenant_name=CONF.ironic.admin_tenant_name)
+    session = ks_session.Session(auth=auth)
+    adapter = LimitedHTTPAdapter(limiter, pool_size)
+    session.session.mount('http://', adapter)
+    session.session.mount('https://', adapter)
+    return session
+
+
+# Sent to joiners when the request they share was cancelled, e.g. by a
+# GreenletExit or Timeout of its sender, they send their own then
+_RETRY = object()
+
+
+class _Pending(object):
+    def __init__(self, generation):
+        self.event = event.Event()
+        self.generation = generation
+
+
 class IronicClientWrapper(object):
+    """Wraps the upstream client wrapper.
+
+    Adds the optional node.list filter, an opt-in pooled keep-alive session
+    with an adaptive bound on concurrent requests and sharing of identical
+    in-flight node.get and node.list_ports requests.
+
+    A shared request is only joined when no write completed since it was
+    sent, so a read following the caller's own update never returns older
+    data. Writes by other clients of Ironic are not seen that way, readers
+    get what a request sent slightly earlier would have returned.
+    """
+    dedup_calls = ('node.get', 'node.list_ports')
+    write_prefixes = ('create', 'delete', 'update', 'set_', 'vendor_passthru')
+
     def __init__(self, parent):
         self.client = parent
         self.node_list_re = re.compile(CONF.symcpe.bm_filter_value)
+        self.limiter = AdaptiveLimiter(CONF.symcpe.ironic_min_concurrency,
+                                       CONF.symcpe.ironic_max_concurrency)
+        self._inflight = {}
+        # Completed writes, see _shared_call
+        self._generation = 0
+        self._session = None
+        self._pooled_client = None
+        self._pool_size = (
+            CONF.symcpe.ironic_pool_size
+            if isinstance(parent, client_wrapper.IronicClientWrapper) else 0)
+
+    def _ensure_pooled_client(self):
+        # Upstream drops its cached client on Unauthorized, put ours back
+        if (not self._pool_size or
+                self.client._cached_client is not None and
+                self.client._cached_client is self._pooled_client):
+            return
+        try:
+            if self._session is None:
+                self._session = _pooled_session(self._pool_size,
+                                                self.limiter)
+            else:
+                self._session.invalidate()
+            api_version = client_wrapper.IRONIC_API_VERSION
+            # The Liberty wrapper only retries Unauthorized and leaves
+            # 409/503 to ironicclient, like it does for its own client.
+            # ironicclient retries per HTTP request, so every attempt
+            # goes through the adapter and no slot is held while sleeping.
+            self._pooled_client = driver.ironic.client.Client(
+                api_version[0], CONF.ironic.api_endpoint,
+                session=self._session,
+                os_ironic_api_version='%d.%d' % api_version,
+                max_retries=CONF.ironic.api_max_retries,
+                retry_interval=CONF.ironic.api_retry_interval)
+        except Exception:
+            LOG.exception('Failed to set up pooled Ironic session, using '
+                          'the upstream client')
+            self._pool_size = 0
+            return
+        self.client._cached_client = self._pooled_client
+
+    def _call(self, func, *args, **kwargs):
+        self._ensure_pooled_client()
+        return self.client.call(func, *args, **kwargs)
+
+    def _shared_call(self, func, *args, **kwargs):
+        key = (func, args, tuple(sorted(kwargs.items())))
+        try:
+            pending = self._inflight.get(key)
+        except TypeError:
+            return self._call(func, *args, **kwargs)
+        if pending is not None and pending.generation == self._generation:
+            result = pending.event.wait()
+            if result is not _RETRY:
+                return result
+            return self._call(func, *args, **kwargs)
+
+        # Replaces a request sent before the latest write, if any
+        pending = self._inflight[key] = _Pending(self._generation)
+        try:
+            result = self._call(func, *args, **kwargs)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                pending.event.send_exception(*sys.exc_info())
+        except BaseException:
+            # Not the joiners' business, they must not die of it
+            with excutils.save_and_reraise_exception():
+                pending.event.send(_RETRY)
+        else:
+            pending.event.send(result)
+            return result
+        finally:
+            if self._inflight.get(key) is pending:
+                del self._inflight[key]
 
     def call(self, func, *args, **kwargs):
         def filter_node(_node):
@@ -96,23 +306,102 @@ class IronicClientWrapper(object):
                 temp = temp[_i]
             return bool(self.node_list_re.findall(temp))
 
-        if func == 'node.list':
+        if func in self.dedup_calls:
+            return self._shared_call(func, *args, **kwargs)
+        # Field limited listings (the state watcher) are never filtered
+        node_filter = (CONF.symcpe.bm_filter_enabled and
+                       func == 'node.list' and not kwargs.get('fields'))
+        if node_filter:
             kwargs['detail'] = True
-        result = self.client.call(func, *args, **kwargs)
-        if func == 'node.list':
+        try:
+            result = self._call(func, *args, **kwargs)
+        finally:
+            if func.split('.')[-1].startswith(self.write_prefixes):
+                self._generation += 1
+        if node_filter:
             return [i for i in result if filter_node(i)]
         else:
             return result
 
 
+# (cidr, gateway) -> configdrive facts, the same few subnets serve all builds
+SUBNET_FACTS = {}
+
+
+def subnet_facts(subnet):
+    key = (subnet['cidr'], subnet['gateway']['address'])
+    facts = SUBNET_FACTS.get(key)
+    if facts is None:
+        facts = SUBNET_FACTS[key] = {
+            'mask': str(netaddr.IPNetwork(subnet['cidr']).netmask),
+            'gw': subnet['gateway']['address']}
+    return facts
+
+
+class Base64Writer(object):
+    """File-like object base64 encoding whatever is written to stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b''
+
+    def write(self, data):
+        data = self.pending + data
+        cut = len(data) - len(data) % 3
+        self.pending = data[cut:]
+        self.stream.write(base64.b64encode(data[:cut]))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.stream.write(base64.b64encode(self.pending))
+        self.pending = b''
+
+
 class SymIronicDriver(driver.IronicDriver):
     """Hypervisor driver for Ironic - bare metal provisioning."""
 
     def __init__(self, *args, **kwargs):
         super(SymIronicDriver, self).__init__(*args, **kwargs)
-        if CONF.symcpe.bm_filter_enabled:
-            self.ironicclient = IronicClientWrapper(self.ironicclient)
+        self.ironicclient = instrumentation.client(
+            IronicClientWrapper(self.ironicclient), 'ironic')
+        self._node_watcher = watcher.NodeStateWatcher(self.ironicclient)
+        self._names = naming.INDEX
+
+    def _refresh_cache(self):
+        """Keep the naming index in sync with the periodic node listing."""
+        super(SymIronicDriver, self)._refresh_cache()
+        self._names.update(self.node_cache.values())
+
+    def _watched(self, ironicclient):
+        # Stay below the upstream loop interval so the fixed interval
+        # looping call never complains about outlasting it
+        return watcher.WatchedClient(
+            ironicclient, self._node_watcher,
+            CONF.ironic.api_retry_interval * 0.9)
+
+    def _wait_for_active(self, ironicclient, instance):
+        """Poll the shared node state watcher instead of node.get.
+
+        Upstream keeps calling this every api_retry_interval until it raises
+        (LoopingCallDone included), which is when the waiter is dropped.
+        """
+        try:
+            return super(SymIronicDriver, self)._wait_for_active(
+                self._watched(ironicclient), instance)
+        except Exception:
+            self._node_watcher.unregister(instance.uuid)
+            raise
+
+    def _unprovision(self, ironicclient, instance, node):
+        try:
+            return super(SymIronicDriver, self)._unprovision(
+                self._watched(ironicclient), instance, node)
+        finally:
+            self._node_watcher.unregister(instance.uuid)
 
+    @instrumentation.timed('macs_for_instance', instance_arg=1)
     def macs_for_instance(self, instance):
         """ Returns (mac, extra) factory. Is returned instead of MAC
         in original driver.
@@ -125,6 +414,7 @@ class SymIronicDriver(driver.IronicDriver):
             raise exception.NotFound()
         return MacFactory(instance, node)
 
+    @instrumentation.timed('generate_name', instance_arg=2)
     def generate_name(self, context, instance, node):
         """
         Generate name. It is expected that node name is in format:
@@ -137,34 +427,58 @@ class SymIronicDriver(driver.IronicDriver):
         cluster = instance.metadata.get('cluster') or context.project_name
         raid = instance.metadata.get('raid') or 'jbod'
 
-        node = self.ironicclient.call("node.get", node)
-        name = node.name.split('-')
-        name = '-'.join([name[0], role] + name[-2:])
-        zone = node.extra['dns_zone']
-        rack = node.properties['rack']
-        return name, {'rack': rack,
-                      'dns_zone': zone,
-                      'dns_domain': zone,
-                      'role': role,
-                      'cluster': cluster,
-                      'raid': raid}
+        entry = self._names.get(node)
+        if entry is None:
+            # Not listed yet by the periodic task
+            entry = self._names.add(self.ironicclient.call("node.get", node))
+        return entry.hostname(role), {'rack': entry.rack,
+                                      'dns_zone': entry.zone,
+                                      'dns_domain': entry.zone,
+                                      'role': role,
+                                      'cluster': cluster,
+                                      'raid': raid}
 
+    @instrumentation.timed('generate_configdrive', instance_arg=1)
     def _generate_configdrive(self, instance, node, network_info,
                               extra_md=None, files=None):
         """ Patch meta data with node extra.
+
+        Replaces upstream in order to stream the image: the ISO is gzipped
+        and base64 encoded on the way to a temporary file, so the only full
+        copy in memory is the returned string.
         """
+        extra_md = dict(extra_md or {})
+        # Referenced, not copied, it is serialized once by the metadata
         extra_md['node_extra'] = node.extra
         # Not really is required, but is convenient to have it
         extra_md['node_ips'] = dict(
             (net['network']['label'],
-             dict(ip=net['network']['subnets'][0]['ips'][0]['address'],
-                  mask=str(netaddr.IPNetwork(
-                      net['network']['subnets'][0]['cidr']).netmask),
-                  gw=net['network']['subnets'][0]['gateway']['address']))
+             dict(subnet_facts(net['network']['subnets'][0]),
+                  ip=net['network']['subnets'][0]['ips'][0]['address']))
             for net in network_info)
-        return super(SymIronicDriver, self)._generate_configdrive(
-            instance, node, network_info, extra_md, files)
 
+        i_meta = instance_metadata.InstanceMetadata(
+            instance, content=files, extra_md=extra_md,
+            network_info=network_info)
+        with tempfile.NamedTemporaryFile() as uncompressed:
+            try:
+                with configdrive.ConfigDriveBuilder(instance_md=i_meta) as cdb:
+                    cdb.make_drive(uncompressed.name)
+            except Exception as e:
+                with excutils.save_and_reraise_exception():
+                    LOG.error(_LE("Creating config drive failed with "
+                                  "error: %s"), e, instance=instance)
+
+            with tempfile.TemporaryFile() as encoded:
+                writer = Base64Writer(encoded)
+                with gzip.GzipFile(fileobj=writer, mode='wb') as gzipped:
+                    uncompressed.seek(0)
+                    shutil.copyfileobj(uncompressed, gzipped)
+                writer.close()
+                encoded.seek(0)
+                return encoded.read()
+
+    @instrumentation.timed('plug_vifs', instance_arg=2)
     def _plug_vifs(self, node, instance, network_info):
         # Here we do an assumption that only mgmt is required for pxe
         self._unplug_vifs(node, instance, network_info)
@@ -203,6 +517,7 @@ class SymIronicDriver(driver.IronicDriver):
             except driver.ironic.exc.BadRequest:
                 pass
 
+    @instrumentation.timed('add_driver_fields', instance_arg=2)
     def _add_driver_fields(self, node, instance, *args, **kwargs):
         super(SymIronicDriver, self)._add_driver_fields(
             node, instance, *args, **kwargs)
@@ -0,0 +1,197 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Shared provision state watcher for in-flight deploys and tear downs.
+
+Instead of every spawn/destroy polling node.get_by_instance_uuid on its
+own, a single green thread lists all associated nodes with a limited set
+of fields and wakes up the waiters whose node changed state. The polling
+interval shrinks to deploy_watch_min_interval on changes and doubles up to
+deploy_watch_max_interval while nothing happens. New waiters cut a long
+sleep short, but polls never start less than deploy_watch_min_interval
+apart, so a burst of deploys is served by a single poll.
+"""
+
+import time
+
+import eventlet
+from eventlet import event
+from nova import utils
+from oslo_config import cfg
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+opts = [
+    cfg.FloatOpt('deploy_watch_min_interval', default=1.0,
+                 help='Shortest interval between node state polls'),
+    cfg.FloatOpt('deploy_watch_max_interval', default=10.0,
+                 help='Longest interval between node state polls'),
+]
+CONF = cfg.CONF
+CONF.register_opts(opts, 'symcpe')
+
+# HTTP statuses of an Ironic API not supporting the fields parameter
+UNSUPPORTED = (400, 406)
+FIELDS = ['uuid', 'instance_uuid', 'power_state', 'provision_state',
+          'target_provision_state', 'last_error']
+
+
+def _state(node):
+    if node is None:
+        return None
+    return (node.provision_state, node.target_provision_state,
+            node.last_error)
+
+
+class _Waiter(object):
+    def __init__(self):
+        self.event = event.Event()
+        self.node = None
+        self.version = 0
+        self.seen = 0
+        self.touched = time.time()
+
+    def update(self, node):
+        changed = self.version == 0 or _state(node) != _state(self.node)
+        self.node = node
+        if changed:
+            self.wake()
+        return changed
+
+    def wake(self):
+        self.version += 1
+        current, self.event = self.event, event.Event()
+        current.send()
+
+
+class NodeStateWatcher(object):
+    def __init__(self, ironicclient):
+        self.ironicclient = ironicclient
+        self._waiters = {}
+        self._fields = FIELDS
+        self._healthy = False
+        self._interval = CONF.symcpe.deploy_watch_min_interval
+        self._last_poll = 0.0
+        self._polling = False
+        self._wakeup = event.Event()
+
+    def wait(self, instance_uuid, timeout):
+        """Wait up to ``timeout`` for the node of the instance to change.
+
+        :return: the latest node seen for the instance or None when the
+            watcher does not know it, the caller then has to ask Ironic.
+        """
+        waiter = self._waiters.get(instance_uuid)
+        if waiter is None:
+            waiter = self._waiters[instance_uuid] = _Waiter()
+            self._interval = CONF.symcpe.deploy_watch_min_interval
+            if not self._polling:
+                self._polling = True
+                utils.spawn_n(self._poll)
+            elif not self._wakeup.ready():
+                # Poll as soon as allowed instead of finishing a long sleep
+                self._wakeup.send()
+        waiter.touched = time.time()
+        if waiter.version == waiter.seen:
+            with eventlet.Timeout(timeout, False):
+                waiter.event.wait()
+        waiter.seen = waiter.version
+        return waiter.node if self._healthy else None
+
+    def unregister(self, instance_uuid):
+        self._waiters.pop(instance_uuid, None)
+
+    def _list(self):
+        if self._fields:
+            try:
+                return self.ironicclient.call('node.list', associated=True,
+                                              limit=0, fields=self._fields)
+            except Exception as exc:
+                # A TypeError comes from a client too old to know fields,
+                # anything else is retried with fields on the next poll
+                if (not isinstance(exc, TypeError) and
+                        getattr(exc, 'http_status', None) not in UNSUPPORTED):
+                    raise
+                LOG.warning('Field limited node.list is not supported, '
+                            'falling back to detailed listing: %s', exc)
+                self._fields = None
+        return self.ironicclient.call('node.list', associated=True,
+                                      limit=0, detail=True)
+
+    def _poll(self):
+        while self._waiters:
+            delay = (self._last_poll + CONF.symcpe.deploy_watch_min_interval -
+                     time.time())
+            if delay > 0:
+                eventlet.sleep(delay)
+            self._last_poll = time.time()
+            # Waiters registering from now on need the next poll
+            self._wakeup = event.Event()
+            try:
+                nodes = dict((node.instance_uuid, node)
+                             for node in self._list())
+                self._healthy = True
+            except Exception:
+                LOG.exception('Failed to poll node states')
+                nodes = None
+                self._healthy = False
+
+            changed = False
+            for instance_uuid, waiter in list(self._waiters.items()):
+                if nodes is None:
+                    # Wake everybody up to fall back to direct calls
+                    waiter.wake()
+                elif waiter.update(nodes.get(instance_uuid)):
+                    changed = True
+            self._prune()
+
+            if changed:
+                self._interval = CONF.symcpe.deploy_watch_min_interval
+            else:
+                self._interval = min(self._interval * 2,
+                                     CONF.symcpe.deploy_watch_max_interval)
+            delay = self._last_poll + self._interval - time.time()
+            if delay > 0:
+                with eventlet.Timeout(delay, False):
+                    self._wakeup.wait()
+        self._polling = False
+
+    def _prune(self):
+        # Waiters whose loop ended without unregistering, e.g. killed
+        expired = time.time() - 10 * CONF.symcpe.deploy_watch_max_interval
+        for instance_uuid, waiter in list(self._waiters.items()):
+            if waiter.touched < expired:
+                self.unregister(instance_uuid)
+
+
+class WatchedClient(object):
+    """Client facade answering provision state polls from the watcher.
+
+    Passed to the upstream polling loops in place of the ironic client,
+    every other call goes to the real client.
+    """
+
+    def __init__(self, ironicclient, watcher, timeout):
+        self.ironicclient = ironicclient
+        self.watcher = watcher
+        self.timeout = timeout
+
+    def call(self, method, *args, **kwargs):
+        if method == 'node.get_by_instance_uuid':
+            node = self.watcher.wait(args[0], self.timeout)
+            if node is not None:
+                return node
+        return self.ironicclient.call(method, *args, **kwargs)
@@ -0,0 +1,89 @@
+# Copyright 2016 Symantec, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import unittest
+
+import mock
+from nova.virt.ironic import client_wrapper
+from nova.virt.ironic import driver as ironic_driver
+from oslo_config import cfg
+from oslo_utils import importutils
+from requests import adapters
+import requests
+
+from symcpe.ironic.nova.virt.ironic import driver
+
+
+CONF = cfg.CONF
+
+NODE_UUID = '1be26c0b-03f2-4d2e-ae87-c02d7f33c123'
+
+
+def _response(request, status, body):
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = status
+    response.reason = 'Conflict' if status == 409 else 'OK'
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body).encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+class PooledClientTestCase(unittest.TestCase):
+    def setUp(self):
+        super(PooledClientTestCase, self).setUp()
+        overrides = [('api_endpoint', 'http://ironic.example.com:6385/',
+                      'ironic'),
+                     ('admin_auth_token', 'token', 'ironic'),
+                     ('api_max_retries', 3, 'ironic'),
+                     ('api_retry_interval', 0, 'ironic'),
+                     ('ironic_pool_size', 2, 'symcpe')]
+        for name, value, group in overrides:
+            CONF.set_override(name, value, group)
+            self.addCleanup(CONF.clear_override, name, group)
+        # Normally imported by IronicDriver.__init__
+        ironic = importutils.import_module('ironicclient')
+        importutils.import_module('ironicclient.client')
+        patcher = mock.patch.object(ironic_driver, 'ironic', ironic)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wrapper = driver.IronicClientWrapper(
+            client_wrapper.IronicClientWrapper())
+
+    def test_conflict_is_retried(self):
+        statuses = [409, 200]
+
+        def send(adapter, request, **kwargs):
+            status = statuses.pop(0)
+            if status == 409:
+                body = {'error_message': json.dumps(
+                    {'faultstring': 'Node %s is locked' % NODE_UUID})}
+            else:
+                body = {'uuid': NODE_UUID}
+            return _response(request, status, body)
+
+        with mock.patch.object(adapters.HTTPAdapter, 'send', autospec=True,
+                               side_effect=send) as mock_send:
+            node = self.wrapper.call('node.get', NODE_UUID)
+
+        self.assertEqual(NODE_UUID, node.uuid)
+        self.assertEqual(2, mock_send.call_count)
+        self.assertIs(self.wrapper._pooled_client,
+                      self.wrapper.client._cached_client)
+        # The 409 was seen by the limiter
+        self.assertLess(self.wrapper.limiter.limit,
+                        CONF.symcpe.ironic_max_concurrency)